@@ -0,0 +1,125 @@
+import argparse
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+from comb import run_parser
+
+with redirect_stdout(io.StringIO()):
+    import day7
+    import day18_p2
+
+ADJECTIVES = ["light", "dark", "bright", "muted", "shiny", "faded", "dotted", "vibrant", "posh", "wavy"]
+COLOURS = ["red", "orange", "white", "yellow", "gold", "olive", "plum", "blue", "black", "tan", "teal"]
+
+
+def gen_rules(n, rng):
+    lines = []
+    for _ in range(n):
+        head = f"{rng.choice(ADJECTIVES)} {rng.choice(COLOURS)} bags contain "
+        k = rng.randint(0, 4)
+        if not k:
+            lines.append(head + "no other bags.")
+            continue
+        contents = []
+        for _ in range(k):
+            amount = rng.randint(1, 9)
+            contents.append(f"{amount} {rng.choice(ADJECTIVES)} {rng.choice(COLOURS)} {'bag' if amount == 1 else 'bags'}")
+        lines.append(head + ", ".join(contents) + ".")
+    return lines
+
+
+def gen_expr(rng, depth):
+    terms = []
+    for _ in range(rng.randint(2, 5)):
+        if depth and rng.random() < 0.3:
+            terms.append(f"({gen_expr(rng, depth - 1)})")
+        else:
+            terms.append(str(rng.randint(1, 9)))
+    return terms[0] + "".join(f" {rng.choice('+*')} {t}" for t in terms[1:])
+
+
+def gen_exprs(n, rng):
+    return [gen_expr(rng, 3) for _ in range(n)]
+
+
+def gen_nested(depth):
+    return "(" * depth + "1 + 2 * 3" + ")" * depth
+
+
+def time_lines(parser, lines, **kwargs):
+    start = time.perf_counter()
+    for line in lines:
+        run_parser(parser, line, **kwargs)
+    return time.perf_counter() - start
+
+
+def peak_memory(parser, lines, **kwargs):
+    tracemalloc.start()
+    try:
+        for line in lines:
+            run_parser(parser, line, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(grammar, parser, lines, **kwargs):
+    seconds = time_lines(parser, lines, **kwargs)
+    n_bytes = sum(len(line) for line in lines)
+    return {
+        "grammar": grammar,
+        "lines": len(lines),
+        "bytes": n_bytes,
+        "options": kwargs,
+        "seconds": seconds,
+        "lines_per_second": len(lines) / seconds,
+        "bytes_per_second": n_bytes / seconds,
+        "peak_memory_bytes": peak_memory(parser, lines, **kwargs),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the comb parser combinators.")
+    ap.add_argument("--max-lines", type=int, default=10 ** 5, help="largest input size, in lines (sizes go up in powers of 10 from 10^3)")
+    ap.add_argument("--depths", type=int, nargs="*", default=[10, 100, 1000, 10000], help="nesting depths for deeply nested expressions")
+    ap.add_argument("--seed", type=int, default=2020)
+    ap.add_argument("--output", default="bench_comb.json", help="where to write the results as JSON")
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+
+    sizes = []
+    n = 10 ** 3
+    while n <= args.max_lines:
+        sizes.append(n)
+        n *= 10
+
+    for n in sizes:
+        results.append(measure("day7.parse_rule", day7.parse_rule, gen_rules(n, rng)))
+        results.append(measure("day18_p2.parse_expr", day18_p2.parse_expr, gen_exprs(n, rng)))
+
+    for depth in args.depths:
+        line = [gen_nested(depth)]
+        try:
+            results.append(dict(measure("day18_p2.parse_expr", day18_p2.parse_expr, line), depth=depth))
+        except RecursionError:
+            print(f"depth {depth} is too deep without trampoline=True", file=sys.stderr)
+        results.append(dict(measure("day18_p2.parse_expr", day18_p2.parse_expr, line, trampoline=True), depth=depth))
+
+    for r in results:
+        depth = f" depth={r['depth']}" if "depth" in r else ""
+        print(f"{r['grammar']:<22}{depth:<12} {r['lines']:>8} lines {r['lines_per_second']:>12.0f} lines/s "
+              f"{r['bytes_per_second'] / 1e6:>8.2f} MB/s {r['peak_memory_bytes'] / 1024:>10.1f} KiB peak {r['options'] or ''}")
+
+    with open(args.output, "w") as f:
+        json.dump({"python": sys.version, "seed": args.seed, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
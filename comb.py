@@ -1,89 +1,448 @@
+from __future__ import annotations
+
+import ast
+import copy
+import inspect
+import linecache
+import re
+import textwrap
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from functools import wraps
-from typing import Optional, Tuple, TypeVar, Callable, Coroutine, List, Any
+from itertools import islice, repeat
+from mmap import mmap
+from typing import Dict, FrozenSet, Generator, Optional, Pattern, Tuple, TypeVar, Callable, Coroutine, Iterable, Iterator, List, Any, Union
 
 NoneType = type(None)
 
-class StringView:
-    def __init__(self, s: str, idx: int = 0):
-        self.s = s
-        self.idx = idx
-        self.end = len(s)
-
-    def at_end(self):
-        return self.idx == self.end
-
-    def peek(self) -> Optional[str]:
-        if self.at_end():
-            return None
-        return self.s[self.idx]
-
-    def next(self) -> 'ParserResult[str]':
-        if self.at_end():
-            return (False, self, None)
-        r = self.s[self.idx]
-        sv = StringView(self.s, self.idx + 1)
-        return (True, sv, r)
+# Parsers walk an integer offset over the shared input buffer rather than
+# allocating a new view per character: every parser is called as
+# ``p(s, idx)`` and returns ``(success, next_idx, value)``. When a parser
+# fails, next_idx is how far it got before failing.
+#
+# The buffer may also be bytes-like (bytes, memoryview, mmap), in which case
+# offsets are byte offsets and each byte is treated as the latin-1 character
+# with the same value, so grammars and their results are unchanged.
 
+Input = Union[str, bytes, bytearray, memoryview, mmap]
 
 T = TypeVar('T')
-ParserResult = Tuple[bool, StringView, Optional[T]]
-ParserFunction = Callable[[StringView], ParserResult[T]]
-
-
-def parser_generator(gen_fn: Callable[[], Coroutine[ParserResult[T], StringView, T]]) -> ParserFunction[T]:
-    def inner(view: StringView) -> ParserResult[T]:
-        orig_view = view
+ParserResult = Tuple[bool, int, Optional[T]]
+ParserFunction = Callable[[Input, int], ParserResult[T]]
+
+# Parsers that run other parsers also have a ``steps`` attribute: a
+# generator function taking the same arguments, which yields each
+# (parser, offset) it wants run, is sent back the result, and returns its own
+# result. _trampoline drives these from an explicit stack, so nesting depth
+# costs heap rather than Python frames.
+#
+# A parser with steps may also have a ``leaf`` attribute, true when running
+# it only ever nests a bounded number of other parsers (it never recurses),
+# so the trampoline can just call it. Like ``first``, it may be a callable
+# worked out on first use.
+ParserSteps = Generator[Tuple[ParserFunction[Any], int], ParserResult[Any], ParserResult[T]]
+
+# Packrat table for the run_parser call in progress, keyed by
+# (rule, offset). None when memoization is off.
+_memo: Optional[dict] = None
+
+# The active Profile, if any.
+_profile: Optional[Profile] = None
+
+# A parser's ``first`` attribute, when present, is the set of ASCII
+# characters it can start with: it never succeeds at the end of the input or
+# when the next character is ASCII and not in the set. It may be a callable
+# computing the set lazily, for parsers built from rules that might not be
+# defined yet. Non-ASCII lookahead is never used to rule a parser out.
+_ASCII = [chr(c) for c in range(128)]
+_first_in_progress: set = set()
+
+
+def _first_set(p: ParserFunction[Any]) -> Optional[FrozenSet[str]]:
+    first = getattr(p, "first", None)
+    if not callable(first):
+        return first
+    if p in _first_in_progress:
+        return None
+    _first_in_progress.add(p)
+    try:
+        return first()
+    finally:
+        _first_in_progress.discard(p)
+
+
+_leaf_in_progress: set = set()
+
+
+def _leaf(p: ParserFunction[Any]) -> bool:
+    leaf = getattr(p, "leaf", None)
+    if leaf is None:
+        return not hasattr(p, "steps")
+    if not callable(leaf):
+        return leaf
+    # Reaching p again means it can recurse.
+    if p in _leaf_in_progress:
+        return False
+    _leaf_in_progress.add(p)
+    try:
+        leaf = p.leaf = leaf()
+    finally:
+        _leaf_in_progress.discard(p)
+    return leaf
+
+
+def _literal_first(literal: str) -> Optional[FrozenSet[str]]:
+    if not literal:
+        return None
+    if ord(literal[0]) < 128:
+        return frozenset(literal[0])
+    return frozenset()
+
+
+class _Uncompilable(Exception):
+    pass
+
+
+class _YieldHoister(ast.NodeTransformer):
+    # Pulls the yields out of a statement in evaluation order, replacing each
+    # with a temporary that holds the result of running the yielded parser.
+    def __init__(self, compiler: '_RuleCompiler'):
+        self.compiler = compiler
+        self.hoisted: List[Tuple[str, str]] = []
+
+    def visit_Yield(self, node: ast.Yield) -> ast.AST:
+        self.generic_visit(node)
+        if node.value is None:
+            raise _Uncompilable
+        name = self.compiler.temporary()
+        self.hoisted.append((name, self.compiler.parser_source(node.value)))
+        return ast.Name(name, ast.Load())
+
+    def visit_YieldFrom(self, node: ast.YieldFrom) -> ast.AST:
+        raise _Uncompilable
+
+    # Hoisting a yield out of a short-circuiting expression would run its
+    # parser unconditionally.
+    def visit_BoolOp(self, node: ast.AST) -> ast.AST:
+        if any(isinstance(n, ast.Yield) for n in ast.walk(node)):
+            raise _Uncompilable
+        return node
+    visit_IfExp = visit_BoolOp
+
+    # Nested scopes own their yields.
+    def visit_Lambda(self, node: ast.Lambda) -> ast.AST:
+        return node
+
+
+class _RuleCompiler:
+    # Rewrites a parser_generator coroutine into a plain function which calls
+    # each yielded parser inline, so running a rule needs no generator
+    # machinery. Yielded parsers built only from globals (such as
+    # consume_whitespace() or consume_string("bags contain")) are constructed
+    # once, on the rule's first call, instead of every time it runs.
+    def __init__(self, func: ast.FunctionDef):
+        self.func = func
+        self.local_names = {n.id for n in ast.walk(func) if isinstance(n, ast.Name) and not isinstance(n.ctx, ast.Load)}
+        # The rule's own name is the global factory, so a rule can yield itself.
+        self.local_names.update(n.name for n in ast.walk(func) if isinstance(n, (ast.ExceptHandler, ast.FunctionDef, ast.ClassDef)) and n.name and n is not func)
+        self.consts: List[str] = []
+        # Whether any yielded parser depends on the rule's locals.
+        self.dynamic = False
+        self.temps = 0
+        # Whether yielded parsers are handed to the trampoline rather than
+        # called.
+        self.stepping = False
+
+    def temporary(self) -> str:
+        self.temps += 1
+        return f"_comb_v{self.temps}"
+
+    def parser_source(self, expr: ast.expr) -> str:
+        source = ast.unparse(expr)
+        names = {n.id for n in ast.walk(expr) if isinstance(n, ast.Name)}
+        if any(n in self.local_names or n.startswith("_comb_") for n in names):
+            self.dynamic = True
+            return f"({source})"
+        if source not in self.consts:
+            self.consts.append(source)
+        return f"_comb_k{self.consts.index(source)}"
+
+    def leading_parser(self) -> Optional[str]:
+        # The parser a rule yields before doing anything else, if it is built
+        # only from globals; the rule can only start the way that one does.
+        stmt = self.func.body[0]
+        if isinstance(stmt, (ast.Expr, ast.Assign, ast.Return)) and isinstance(stmt.value, ast.Yield) and stmt.value.value is not None:
+            source = self.parser_source(stmt.value.value)
+            if source.startswith("_comb_k"):
+                return self.consts[int(source[len("_comb_k"):])]
+        return None
+
+    def hoist(self, node: ast.AST) -> Tuple[List[str], ast.AST]:
+        hoister = _YieldHoister(self)
+        node = hoister.visit(node)
+        lines = []
+        for name, parser in hoister.hoisted:
+            if self.stepping:
+                lines.append(f"_comb_ok, _comb_idx, {name} = yield ({parser}, _comb_idx)")
+            else:
+                lines.append(f"_comb_ok, _comb_idx, {name} = {parser}(_comb_s, _comb_idx)")
+            lines.append("if not _comb_ok:")
+            lines.append("    return (False, _comb_idx, None)")
+        return lines, node
+
+    def block(self, stmts: List[ast.stmt]) -> List[str]:
+        lines = []
+        for stmt in stmts:
+            lines.extend(self.statement(stmt))
+        return lines or ["pass"]
+
+    def statement(self, stmt: ast.stmt) -> List[str]:
+        def indented(body: List[ast.stmt]) -> List[str]:
+            return ["    " + line for line in self.block(body)]
+
+        def has_yield(node: ast.AST) -> bool:
+            return any(isinstance(n, (ast.Yield, ast.YieldFrom)) for n in ast.walk(node))
+
+        if isinstance(stmt, (ast.FunctionDef, ast.ClassDef)):
+            if any(map(has_yield, stmt.decorator_list)):
+                raise _Uncompilable
+            return ast.unparse(stmt).splitlines()
+        if isinstance(stmt, ast.Return):
+            lines, value = self.hoist(stmt.value or ast.Constant(None))
+            return lines + [f"return (True, _comb_idx, {ast.unparse(value)})"]
+        if isinstance(stmt, ast.If):
+            lines, test = self.hoist(stmt.test)
+            lines += [f"if {ast.unparse(test)}:"] + indented(stmt.body)
+            if stmt.orelse:
+                lines += ["else:"] + indented(stmt.orelse)
+            return lines
+        if isinstance(stmt, ast.For):
+            lines, it = self.hoist(stmt.iter)
+            lines += [f"for {ast.unparse(stmt.target)} in {ast.unparse(it)}:"] + indented(stmt.body)
+            if stmt.orelse:
+                lines += ["else:"] + indented(stmt.orelse)
+            return lines
+        if isinstance(stmt, ast.While):
+            if has_yield(stmt.test):
+                raise _Uncompilable
+            lines = [f"while {ast.unparse(stmt.test)}:"] + indented(stmt.body)
+            if stmt.orelse:
+                lines += ["else:"] + indented(stmt.orelse)
+            return lines
+        if isinstance(stmt, ast.Try):
+            # Inlined into the try, a sub-parser's exception would be caught
+            # by the rule's own handlers, which it isn't when driven.
+            if any(map(has_yield, stmt.body)):
+                raise _Uncompilable
+            lines = ["try:"] + indented(stmt.body)
+            for handler in stmt.handlers:
+                if handler.type is not None and has_yield(handler.type):
+                    raise _Uncompilable
+                clause = "except"
+                if handler.type is not None:
+                    clause += f" {ast.unparse(handler.type)}"
+                if handler.name:
+                    clause += f" as {handler.name}"
+                lines += [clause + ":"] + indented(handler.body)
+            if stmt.orelse:
+                lines += ["else:"] + indented(stmt.orelse)
+            if stmt.finalbody:
+                lines += ["finally:"] + indented(stmt.finalbody)
+            return lines
+        # Any other compound statement (with, match, try/except*, ...) would
+        # have the yields in its branches hoisted above it and run regardless.
+        if any(isinstance(n, (ast.stmt, ast.excepthandler, ast.match_case)) for n in ast.iter_child_nodes(stmt)):
+            raise _Uncompilable
+        lines, stmt = self.hoist(stmt)
+        if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Name) and stmt.value.id.startswith("_comb_v"):
+            return lines
+        return lines + ast.unparse(stmt).splitlines()
+
+    def body(self, stepping: bool) -> List[str]:
+        # Compiles a copy, as hoisting rewrites the rule's yields.
+        self.stepping = stepping
+        return ["        " + line for line in self.block(copy.deepcopy(self.func.body))]
+
+    def source(self) -> str:
+        # The rule as a plain function, and as a steps generator for the
+        # trampoline, sharing the parsers hoisted into constants.
+        body, steps = self.body(False), self.body(True)
+        names = ", ".join(f"_comb_k{i}" for i in range(len(self.consts)))
+        init = ["        if _comb_k0 is None:", "            _comb_init()"] if self.consts else []
+        lines = ["def _comb_make(_comb_leaf):"]
+        if self.consts:
+            lines.append(f"    {names.replace(',', ' =')} = None")
+            lines.append("    def _comb_init():")
+            lines.append(f"        nonlocal {names}")
+            lines.extend(f"        _comb_k{i} = {c}" for i, c in enumerate(self.consts))
+        # Not named after the rule, which would shadow its factory.
+        for name, stmts in (("_comb_rule", body), ("_comb_steps", steps)):
+            lines.append(f"    def {name}(_comb_s, _comb_idx):")
+            lines.extend(init)
+            lines.extend(stmts)
+            lines.append("        return (True, _comb_idx, None)")
+        lines.append("    _comb_rule.steps = _comb_steps")
+        if not self.dynamic:
+            # Only runs its constants, so it's a leaf if they all are.
+            lines.append("    def _comb_leaves():")
+            lines.extend(init)
+            lines.append(f"        return all(map(_comb_leaf, [{names}]))")
+            lines.append("    _comb_rule.leaf = _comb_leaves")
+        lines.append("    return _comb_rule")
+        return "\n".join(lines) + "\n"
+
+
+def _compile_rule(gen_fn: Callable[..., Any]) -> Optional[ParserFunction[Any]]:
+    if not inspect.isgeneratorfunction(gen_fn) or gen_fn.__code__.co_freevars:
+        return None
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(gen_fn)))
+    except (OSError, TypeError, SyntaxError):
+        return None
+    func = tree.body[0]
+    if not isinstance(func, ast.FunctionDef) or func.name != gen_fn.__name__:
+        return None
+    args = func.args
+    if args.posonlyargs or args.args or args.vararg or args.kwonlyargs or args.kwarg:
+        return None
+    compiler = _RuleCompiler(func)
+    leading = compiler.leading_parser()
+    try:
+        source = compiler.source()
+    except _Uncompilable:
+        return None
+    # Register the generated source so tracebacks through it are readable.
+    filename = f"<comb rule {gen_fn.__module__}.{gen_fn.__qualname__}>"
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace: dict = {}
+    exec(compile(source, filename, "exec"), gen_fn.__globals__, namespace)
+    rule = namespace["_comb_make"](_leaf)
+    if leading is not None:
+        rule.first = lambda: _first_set(eval(leading, gen_fn.__globals__))
+    return rule
+
+
+def parser_generator(gen_fn: Callable[[], Coroutine[ParserFunction[Any], Any, T]]) -> Callable[[], ParserFunction[T]]:
+    def inner(s: Input, idx: int) -> ParserResult[T]:
+        if _memo is None and _profile is None:
+            return run(s, idx)
+        if _profile is not None:
+            return _profile.measure(inner, memoized, s, idx)
+        return memoized(s, idx)
+
+    def memoized(s: Input, idx: int) -> ParserResult[T]:
+        if _memo is None:
+            return run(s, idx)
+        key = (inner, idx)
+        result = _memo.get(key)
+        if result is None:
+            result = _memo[key] = run(s, idx)
+        return result
+
+    def drive(s: Input, idx: int) -> ParserResult[T]:
         it, val = gen_fn(), None
 
         try:
             while True:
                 p = it.send(val)
-                success, view, val = p(view)
+                success, idx, val = p(s, idx)
                 if not success:
-                    return (False, orig_view, None)
+                    return (False, idx, None)
         except StopIteration as e:
-            return (True, view, e.value)
-    return lambda: inner
+            return (True, idx, e.value)
 
+    def steps(s: Input, idx: int) -> ParserSteps[T]:
+        it, val = gen_fn(), None
 
-def consume_whitespace() -> ParserFunction[NoneType]:
-    def inner(view: StringView) -> ParserResult[NoneType]:
-        orig_view = view
         while True:
-            (success, next_view, char) = view.next()
+            try:
+                p = it.send(val)
+            except StopIteration as e:
+                return (True, idx, e.value)
+            success, idx, val = yield (p, idx)
             if not success:
-                return (False, orig_view, None)
-            if not char.isspace():
-                return (True, view, None)
-            view = next_view
+                return (False, idx, None)
+
+    # Rules whose source can't be rewritten are driven as coroutines.
+    run = _compile_rule(gen_fn) or drive
+    if hasattr(run, "first"):
+        inner.first = run.first
+    inner.steps = getattr(run, "steps", steps)
+    if hasattr(run, "leaf"):
+        inner.leaf = run.leaf
+    inner.label = f"{gen_fn.__module__}.{gen_fn.__qualname__}"
+
+    # Named after the rule so that it pickles by reference.
+    @wraps(gen_fn)
+    def factory() -> ParserFunction[T]:
+        return inner
+    return factory
+
+
+# What str.isspace accepts among the latin-1 characters. Byte patterns only
+# know the ASCII whitespace as \s.
+_BYTE_SPACE = r"\t-\r\x1c-\x20\x85\xa0"
+
+
+def _byte_escape(m: re.Match[str]) -> str:
+    if m.group() == r"\s":
+        return f"[{_BYTE_SPACE}]"
+    if m.group() == r"\S":
+        return f"[^{_BYTE_SPACE}]"
+    return m.group()
+
+
+# The str pattern, and the same pattern for latin-1 mapped bytes. \s and \S
+# are widened to match the str behaviour; they must not appear inside a
+# character class.
+def _compile_both(pattern: str, flags: int = 0) -> Tuple[Pattern[str], Pattern[bytes]]:
+    try:
+        byte_pattern = re.sub(r"\\.", _byte_escape, pattern).encode("latin-1")
+    except UnicodeEncodeError:
+        # Can't occur in a byte buffer, so never matches one.
+        byte_pattern = b"(?!)"
+    return re.compile(pattern, flags), re.compile(byte_pattern, flags)
+
+
+# Whitespace must be followed by something, as running off the end of the
+# input is a failure.
+_whitespace_re, _whitespace_bytes_re = _compile_both(r"\s*(?=\S)")
+_integer_re, _integer_bytes_re = _compile_both(r"\d+")
+
+
+def consume_whitespace() -> ParserFunction[NoneType]:
+    def inner(s: Input, idx: int) -> ParserResult[NoneType]:
+        m = (_whitespace_re if isinstance(s, str) else _whitespace_bytes_re).match(s, idx)
+        if m is None:
+            return (False, idx, None)
+        return (True, m.end(), None)
     return inner
 
 
 def consume_string(to_consume: str) -> ParserFunction[str]:
-    def inner(view: StringView) -> ParserResult[str]:
-        orig_view = view
-        for wanted_char in to_consume:
-            (success, view, actual_char) = view.next()
-            if not success or wanted_char != actual_char:
-                return (False, orig_view, None)
-        return (True, view, to_consume)
+    length = len(to_consume)
+    _, byte_pattern = _compile_both(re.escape(to_consume))
+
+    def inner(s: Input, idx: int) -> ParserResult[str]:
+        if isinstance(s, str):
+            if not s.startswith(to_consume, idx):
+                return (False, idx, None)
+        elif byte_pattern.match(s, idx) is None:
+            return (False, idx, None)
+        return (True, idx + length, to_consume)
+    inner.first = _literal_first(to_consume)
     return inner
 
 
 def read_integer() -> ParserFunction[int]:
-    def inner(view: StringView) -> ParserResult[int]:
-        so_far = []
-        orig_view = view
-        while True:
-            (success, next_view, char) = view.next()
-            if not success and not so_far:
-                return (False, orig_view, None)
-            if char is None or not char.isnumeric():
-                if so_far:
-                    return (True, view, int(''.join(so_far)))
-                return (False, view, None)
-            view = next_view
-            so_far.append(char)
+    def inner(s: Input, idx: int) -> ParserResult[int]:
+        m = (_integer_re if isinstance(s, str) else _integer_bytes_re).match(s, idx)
+        if m is None:
+            return (False, idx, None)
+        return (True, m.end(), int(m.group()))
+    inner.first = frozenset("0123456789")
     return inner
 
 
@@ -92,77 +451,508 @@ def consume_any_string(*to_consume: str) -> ParserFunction[str]:
 
 
 def try_parsers(*parsers: ParserFunction[T]) -> ParserFunction[T]:
-    def inner(view: StringView) -> ParserResult[T]:
-        orig_view = view
-        for p in parsers:
-            (success, view, val) = p(orig_view)
-            if success:
-                return (True, view, val)
-        return (False, orig_view, None)
+    # Alternatives worth trying for each ASCII lookahead, and at the end of
+    # the input, worked out from their first sets. This waits for the second
+    # call, by when every rule they mention exists, and so that instances
+    # built afresh on each run of a coroutine rule never pay for it. None
+    # when no first sets are known.
+    dispatch: Optional[Tuple[List[Tuple[ParserFunction[T], ...]], Tuple[ParserFunction[T], ...]]] = None
+    built = False
+    called = False
+
+    def build() -> None:
+        nonlocal dispatch, built
+        built = True
+        firsts = [_first_set(p) for p in parsers]
+        if all(f is None for f in firsts):
+            return
+        by_char = [tuple(p for p, f in zip(parsers, firsts) if f is None or c in f) for c in _ASCII]
+        at_end = tuple(p for p, f in zip(parsers, firsts) if f is None)
+        dispatch = (by_char, at_end)
+
+    def candidates(s: Input, idx: int) -> Tuple[ParserFunction[T], ...]:
+        nonlocal called
+        if not built:
+            if not called:
+                called = True
+                return parsers
+            build()
+        if dispatch is None:
+            return parsers
+        if idx == len(s):
+            return dispatch[1]
+        c = s[idx]
+        code = ord(c) if isinstance(c, str) else c
+        if code < 128:
+            return dispatch[0][code]
+        return parsers
+
+    def inner(s: Input, idx: int) -> ParserResult[T]:
+        if _profile is not None:
+            return _profile.measure(inner, run, s, idx)
+        return run(s, idx)
+
+    def run(s: Input, idx: int) -> ParserResult[T]:
+        furthest = idx
+        for p in candidates(s, idx):
+            result = p(s, idx)
+            if result[0]:
+                return result
+            furthest = max(furthest, result[1])
+        return (False, furthest, None)
+
+    def steps(s: Input, idx: int) -> ParserSteps[T]:
+        furthest = idx
+        for p in candidates(s, idx):
+            result = yield (p, idx)
+            if result[0]:
+                return result
+            furthest = max(furthest, result[1])
+        return (False, furthest, None)
+
+    def first() -> Optional[FrozenSet[str]]:
+        firsts = [_first_set(p) for p in parsers]
+        if any(f is None for f in firsts):
+            return None
+        return frozenset().union(*firsts)
+    inner.first = first
+    inner.steps = steps
+    inner.leaf = lambda: all(map(_leaf, parsers))
+    inner.label = lambda: f"try_parsers({', '.join(map(_label, parsers))})"
     return inner
 
 
 def kleene(p: ParserFunction[T]) -> ParserFunction[List[T]]:
-    def inner(view: StringView) -> ParserResult[List[T]]:
+    def inner(s: Input, idx: int) -> ParserResult[List[T]]:
+        if _profile is not None:
+            return _profile.measure(inner, run, s, idx)
+        return run(s, idx)
+
+    def run(s: Input, idx: int) -> ParserResult[List[T]]:
+        result = []
+        while True:
+            (success, next_idx, val) = p(s, idx)
+            if not success:
+                return (True, idx, result)
+            idx = next_idx
+            result.append(val)
+
+    def steps(s: Input, idx: int) -> ParserSteps[List[T]]:
         result = []
         while True:
-            (success, next_view, val) = p(view)
+            (success, next_idx, val) = yield (p, idx)
             if not success:
-                return (True, view, result)
-            view = next_view
+                return (True, idx, result)
+            idx = next_idx
             result.append(val)
+    inner.steps = steps
+    inner.leaf = lambda: _leaf(p)
+    inner.label = lambda: f"kleene({_label(p)})"
     return inner
 
 
 def optional(p: ParserFunction[T]) -> ParserFunction[Optional[T]]:
-    def inner(view: StringView) -> ParserResult[Optional[T]]:
-        (success, next_view, val) = p(view)
+    def inner(s: Input, idx: int) -> ParserResult[Optional[T]]:
+        (success, next_idx, val) = p(s, idx)
         if not success:
-            return (True, view, None)
-        return (True, next_view, val)
+            return (True, idx, None)
+        return (True, next_idx, val)
+
+    def steps(s: Input, idx: int) -> ParserSteps[Optional[T]]:
+        (success, next_idx, val) = yield (p, idx)
+        if not success:
+            return (True, idx, None)
+        return (True, next_idx, val)
+    inner.steps = steps
+    inner.leaf = lambda: _leaf(p)
+    return inner
+
+
+class CommitFailed(Exception):
+    def __init__(self, idx: int):
+        super().__init__(f"committed parser failed at offset {idx}")
+        self.idx = idx
+
+
+def _release_before(idx: int) -> None:
+    # Nothing before a commit point is worth keeping a packrat entry for.
+    stale = [key for key in _memo if key[1] < idx]
+    for key in stale:
+        del _memo[key]
+
+
+# A cut: once parsing reaches p there's no going back, so if p fails the
+# whole parse fails (run_parser returns None) rather than letting enclosing
+# alternatives backtrack. When p succeeds, packrat entries for the input
+# before it are released, keeping the table flat over long inputs.
+def commit(p: ParserFunction[T]) -> ParserFunction[T]:
+    def inner(s: Input, idx: int) -> ParserResult[T]:
+        result = p(s, idx)
+        if not result[0]:
+            raise CommitFailed(result[1])
+        if _memo is not None:
+            _release_before(idx)
+        return result
+
+    def steps(s: Input, idx: int) -> ParserSteps[T]:
+        result = yield (p, idx)
+        if not result[0]:
+            raise CommitFailed(result[1])
+        if _memo is not None:
+            _release_before(idx)
+        return result
+    # No first set: try_parsers would skip the cut on any other lookahead,
+    # so it wouldn't fire, and nor may a rule that starts with it.
+    inner.steps = steps
+    inner.label = lambda: f"commit({_label(p)})"
+    return inner
+
+
+# Precedence climbing over operand, parsing a whole chain of binary
+# operators in one pass. Each operator is (op, binding_power, associativity,
+# combine), where associativity is "left" or "right" and combine builds the
+# node for (left, right); higher binding powers bind tighter. Operators are
+# tried in order, so list longer ones before any they are a prefix of.
+def operator_precedence(operand: ParserFunction[T],
+                        operators: List[Tuple[ParserFunction[Any], int, str, Callable[[T, T], T]]]) -> ParserFunction[T]:
+    for (_, _, associativity, _) in operators:
+        if associativity not in ("left", "right"):
+            raise ValueError(f"unknown associativity {associativity!r}")
+
+    def climb(s: Input, idx: int, min_power: int) -> ParserResult[T]:
+        (success, idx, left) = operand(s, idx)
+        if not success:
+            return (False, idx, None)
+        while True:
+            for (op, power, associativity, combine) in operators:
+                if power < min_power:
+                    continue
+                (success, after_op, _) = op(s, idx)
+                if success:
+                    break
+            else:
+                return (True, idx, left)
+            next_power = power + 1 if associativity == "left" else power
+            (success, after_op, right) = climb(s, after_op, next_power)
+            if not success:
+                return (True, idx, left)
+            idx = after_op
+            left = combine(left, right)
+
+    # climb, with sub-parsers handed to the trampoline. Recursion here only
+    # goes as deep as a chain of right associative operators.
+    def climb_steps(s: Input, idx: int, min_power: int) -> ParserSteps[T]:
+        (success, idx, left) = yield (operand, idx)
+        if not success:
+            return (False, idx, None)
+        while True:
+            for (op, power, associativity, combine) in operators:
+                if power < min_power:
+                    continue
+                (success, after_op, _) = yield (op, idx)
+                if success:
+                    break
+            else:
+                return (True, idx, left)
+            next_power = power + 1 if associativity == "left" else power
+            (success, after_op, right) = yield from climb_steps(s, after_op, next_power)
+            if not success:
+                return (True, idx, left)
+            idx = after_op
+            left = combine(left, right)
+
+    def inner(s: Input, idx: int) -> ParserResult[T]:
+        return climb(s, idx, 0)
+
+    def steps(s: Input, idx: int) -> ParserSteps[T]:
+        return (yield from climb_steps(s, idx, 0))
+    inner.first = lambda: _first_set(operand)
+    inner.steps = steps
     return inner
 
 
 def take_until(taker: ParserFunction[T], untiller: ParserFunction[Any]) -> ParserFunction[List[T]]:
-    def inner(view: StringView) -> ParserResult[List[T]]:
+    taker_class = getattr(taker, "char_class", None)
+    untiller_class = getattr(untiller, "char_class", None)
+    if taker_class is not None and untiller_class is not None:
+        # Both sides match single characters, so the whole run can be
+        # found with one regex scan.
+        text_re, bytes_re = _compile_both(f"(?:(?!{untiller_class}){taker_class})*(?={untiller_class})", re.DOTALL)
+
+        def scan(s: Input, idx: int) -> ParserResult[List[T]]:
+            if isinstance(s, str):
+                m = text_re.match(s, idx)
+                if m is None:
+                    return (False, idx, None)
+                return (True, m.end(), list(m.group()))
+            m = bytes_re.match(s, idx)
+            if m is None:
+                return (False, idx, None)
+            return (True, m.end(), list(m.group().decode("latin-1")))
+        return scan
+
+    def inner(s: Input, idx: int) -> ParserResult[List[T]]:
         result = []
         while True:
-            (success, _, _) = untiller(view)
+            (success, _, _) = untiller(s, idx)
             if success:
-                return (True, view, result)
-            (success, next_view, val) = taker(view)
+                return (True, idx, result)
+            (success, next_idx, val) = taker(s, idx)
             if not success:
-                return (False, view, None)
-            view = next_view
+                return (False, idx, None)
+            idx = next_idx
             result.append(val)
+
+    def steps(s: Input, idx: int) -> ParserSteps[List[T]]:
+        result = []
+        while True:
+            (success, _, _) = yield (untiller, idx)
+            if success:
+                return (True, idx, result)
+            (success, next_idx, val) = yield (taker, idx)
+            if not success:
+                return (False, idx, None)
+            idx = next_idx
+            result.append(val)
+    inner.steps = steps
+    inner.leaf = lambda: _leaf(taker) and _leaf(untiller)
     return inner
 
 
-def char_fits_predicate(predicate: Callable[[str], bool]) -> ParserFunction[str]:
-    def inner(view: StringView) -> ParserResult[str]:
-        orig_view = view
-        (success, view, char) = view.next()
-        if not success or not predicate(char):
-            return (False, orig_view, None)
-        return (True, view, char)
+# char_class, if given, is a regex matching exactly the characters that
+# predicate accepts, which lets take_until scan in bulk.
+def char_fits_predicate(predicate: Callable[[str], bool], char_class: Optional[str] = None) -> ParserFunction[str]:
+    def inner(s: Input, idx: int) -> ParserResult[str]:
+        if idx == len(s):
+            return (False, idx, None)
+        char = s[idx]
+        if not isinstance(char, str):
+            char = chr(char)
+        if not predicate(char):
+            return (False, idx, None)
+        return (True, idx + 1, char)
+    inner.char_class = char_class
+    if char_class is not None:
+        inner.first = lambda: frozenset(c for c in _ASCII if re.fullmatch(char_class, c, re.DOTALL))
     return inner
 
 
 def is_char(char: str) -> ParserFunction[str]:
-    return char_fits_predicate(lambda c: c == char)
+    return char_fits_predicate(lambda c: c == char, re.escape(char))
 
 
 def is_whitespace() -> ParserFunction[str]:
-    return char_fits_predicate(lambda c: c.isspace())
+    return char_fits_predicate(str.isspace, r"\s")
 
 
 def any_char() -> ParserFunction[str]:
-    def inner(view: StringView) -> ParserResult[str]:
-        return view.next()
+    def inner(s: Input, idx: int) -> ParserResult[str]:
+        if idx == len(s):
+            return (False, idx, None)
+        char = s[idx]
+        if not isinstance(char, str):
+            char = chr(char)
+        return (True, idx + 1, char)
+    inner.char_class = "."
+    inner.first = frozenset(_ASCII)
     return inner
 
-def run_parser(parser: ParserFunction[T], inp: str) -> Optional[T]:
-    (success, _, val) = parser()(StringView(inp))
+def _label(p: ParserFunction[Any]) -> str:
+    label = getattr(p, "label", None)
+    if label is None:
+        # Name primitives after the function that built them.
+        return p.__qualname__.split(".")[0]
+    if callable(label):
+        # Cached, so profiling a parser only builds its label once.
+        label = p.label = label()
+    return label
+
+
+@dataclass
+class ParserStats:
+    calls: int = 0
+    successes: int = 0
+    failures: int = 0
+    # Input consumed by failed attempts before they gave up.
+    backtracked: int = 0
+    # Including time spent in the parsers it ran.
+    seconds: float = 0.0
+
+
+class Profile:
+    # Records per-parser statistics for rules, try_parsers and kleene while
+    # active, e.g.
+    #
+    #     with Profile() as profile:
+    #         run_parser(parse_rule, line)
+    #     print(profile.table())
+    #
+    # Nothing is recorded in trampoline mode.
+    def __init__(self):
+        # Keyed by label, so the combinators that coroutine rules build afresh
+        # on every run are merged rather than each kept alive.
+        self.by_label: Dict[str, ParserStats] = defaultdict(ParserStats)
+        self.outer: Optional[Profile] = None
+
+    def __enter__(self) -> Profile:
+        global _profile
+        self.outer, _profile = _profile, self
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        global _profile
+        _profile = self.outer
+
+    def measure(self, p: ParserFunction[T], run: ParserFunction[T], s: Input, idx: int) -> ParserResult[T]:
+        start = time.perf_counter()
+        result = run(s, idx)
+        stats = self.by_label[_label(p)]
+        stats.seconds += time.perf_counter() - start
+        stats.calls += 1
+        if result[0]:
+            stats.successes += 1
+        else:
+            stats.failures += 1
+            stats.backtracked += result[1] - idx
+        return result
+
+    def stats(self) -> Dict[str, ParserStats]:
+        return dict(self.by_label)
+
+    def table(self) -> str:
+        rows = sorted(self.stats().items(), key=lambda item: item[1].seconds, reverse=True)
+        header = ("parser", "calls", "successes", "failures", "backtracked", "seconds")
+        cells = [header] + [(label, str(st.calls), str(st.successes), str(st.failures), str(st.backtracked), f"{st.seconds:.6f}")
+                            for label, st in rows]
+        widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+        return "\n".join("  ".join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in enumerate(zip(row, widths)))
+                         for row in cells)
+
+
+def _trampoline(parser: ParserFunction[T], s: Input, idx: int) -> ParserResult[T]:
+    if _leaf(parser):
+        return parser(s, idx)
+    # Suspended parsers, each with the packrat key to store its result under.
+    stack: List[Tuple[ParserSteps[Any], Any]] = []
+    # The steps to run each parser met so far by, or None to just call it.
+    plans: Dict[ParserFunction[Any], Any] = {}
+    task, key = parser.steps(s, idx), None
+    result = None
+    while True:
+        try:
+            (p, at) = task.send(result)
+        except StopIteration as e:
+            result = e.value
+            if key is not None:
+                _memo[key] = result
+            if not stack:
+                return result
+            task, key = stack.pop()
+            continue
+        steps = plans.get(p, plans)
+        if steps is plans:
+            steps = plans[p] = None if _leaf(p) else p.steps
+        if steps is None:
+            result = p(s, at)
+            continue
+        if _memo is not None:
+            result = _memo.get((p, at))
+            if result is not None:
+                continue
+        stack.append((task, key))
+        task, key = steps(s, at), ((p, at) if _memo is not None else None)
+        result = None
+
+
+def run_parser(parser: Callable[[], ParserFunction[T]], inp: Input, packrat: bool = False, trampoline: bool = False) -> Optional[T]:
+    # trampoline runs every combinator that can recurse from an explicit
+    # stack instead of the Python call stack, so nesting depth is only
+    # limited by memory, not the recursion limit. Leaf parsers are still
+    # called directly.
+    global _memo
+    outer_memo = _memo
+    _memo = {} if packrat else None
+    try:
+        if trampoline:
+            (success, _, val) = _trampoline(parser(), inp, 0)
+        else:
+            (success, _, val) = parser()(inp, 0)
+    except CommitFailed:
+        return None
+    finally:
+        _memo = outer_memo
     if success:
         return val
     return None
+
+
+def run_parser_stream(parser: Callable[[], ParserFunction[T]], chunks: Iterable[Input], sep: str = "\n", packrat: bool = False) -> Iterator[Optional[T]]:
+    # Runs parser over each sep-delimited record of a chunked stream (such as
+    # blocks read from a file or socket), yielding each result as soon as its
+    # record is complete. Only the unfinished tail of the stream is buffered.
+    if not sep:
+        raise ValueError("sep must not be empty")
+    return (run_parser(parser, record, packrat) for record in _records(chunks, sep))
+
+
+def _records(chunks: Iterable[Input], sep: str) -> Iterator[Input]:
+    parts: List[Input] = []  # the unfinished record, chunk by chunk
+    tail = None  # its last len(sep) - 1 characters, where a split sep may start
+    for chunk in chunks:
+        if not isinstance(chunk, str):
+            chunk = bytes(chunk)
+        if tail is None:
+            empty = tail = chunk[:0]
+            delim = sep if isinstance(chunk, str) else sep.encode("latin-1")
+            overlap = len(delim) - 1
+        start = 0
+        if parts and overlap:
+            # Only a sep straddling the last chunk and this one needs
+            # looking for outside this chunk.
+            at = (tail + chunk[:overlap]).find(delim)
+            if at != -1:
+                record = empty.join(parts)
+                record = record[:len(record) - len(tail) + at]
+                if record:
+                    yield record
+                start = at + len(delim) - len(tail)
+                parts, tail = [], empty
+        while True:
+            end = chunk.find(delim, start)
+            if end == -1:
+                break
+            record = empty.join(parts) + chunk[start:end] if parts else chunk[start:end]
+            if record:
+                yield record
+            parts, tail = [], empty
+            start = end + len(delim)
+        if start < len(chunk):
+            parts.append(chunk[start:])
+            if overlap:
+                tail = (tail + chunk[start:])[-overlap:]
+    if parts:
+        yield empty.join(parts)
+
+
+def _run_batch(parser: Callable[[], ParserFunction[T]], lines: List[Input], packrat: bool) -> List[Optional[T]]:
+    return [run_parser(parser, line, packrat) for line in lines]
+
+
+def _batches(lines: Iterable[Input], batch_size: int) -> Iterator[List[Input]]:
+    it = iter(lines)
+    while batch := list(islice(it, batch_size)):
+        yield batch
+
+
+def run_parser_many(parser: Callable[[], ParserFunction[T]], lines: Iterable[Input], workers: Optional[int] = None,
+                    batch_size: int = 10000, packrat: bool = False) -> List[Optional[T]]:
+    # Parses each line independently, sharding batches of lines across a
+    # process pool. Results come back in input order. The parser must be a
+    # module-level rule so that workers can look it up.
+    if workers == 1:
+        return _run_batch(parser, list(lines), packrat)
+    results = []
+    with ProcessPoolExecutor(workers) as pool:
+        for batch in pool.map(_run_batch, repeat(parser), _batches(lines, batch_size), repeat(packrat)):
+            results.extend(batch)
+    return results
@@ -1,5 +1,5 @@
 import comb
-from comb import consume_any_string, consume_whitespace, is_char, kleene, parser_generator, read_integer, run_parser, try_parsers
+from comb import consume_string, consume_whitespace, is_char, operator_precedence, parser_generator, read_integer, run_parser, try_parsers
 
 class Add:
     def __init__(self, left, right) -> None:
@@ -46,27 +46,14 @@ def parse_int():
     return Integer(r)
 
 @parser_generator
-def parse_op_rhs():
+def parse_op_add():
     yield consume_whitespace()
-    op = yield consume_any_string("+", "*")
-    c = {"+": Add, "*": Mul}[op]
-    yield consume_whitespace()
-    r = yield parse_paren_or_int()
-    return (c, r)
+    yield consume_string("+")
 
 @parser_generator
-def parse_op():
-    l = yield parse_paren_or_int()
-    rhs_s = yield kleene(parse_op_rhs())
-
-    e = l
-
-    print(rhs_s)
-
-    for (c, r) in rhs_s:
-        e = c(e, r)
-
-    return e
+def parse_op_mul():
+    yield consume_whitespace()
+    yield consume_string("*")
 
 @parser_generator
 def parse_paren_or_int():
@@ -75,8 +62,7 @@ def parse_paren_or_int():
 
 @parser_generator
 def parse_expr():
-    yield consume_whitespace()
-    return (yield try_parsers(parse_op(), parse_paren(), parse_int()))
+    return (yield operator_precedence(parse_paren_or_int(), [(parse_op_add(), 1, "left", Add), (parse_op_mul(), 1, "left", Mul)]))
 
 @parser_generator
 def parse_paren():
@@ -3,7 +3,7 @@ from comb import (
     consume_string,
     consume_whitespace,
     is_char,
-    kleene,
+    operator_precedence,
     parser_generator,
     read_integer,
     run_parser,
@@ -59,51 +59,15 @@ def parse_int():
 
 
 @parser_generator
-def parse_op_mul_rhs():
+def parse_op_mul():
     yield consume_whitespace()
     yield consume_string("*")
-    yield consume_whitespace()
-    r = yield parse_paren_or_add_or_int()
-    return (Mul, r)
 
 
 @parser_generator
-def parse_op_add_rhs():
+def parse_op_add():
     yield consume_whitespace()
     yield consume_string("+")
-    yield consume_whitespace()
-    r = yield parse_paren_or_int()
-    return (Add, r)
-
-
-@parser_generator
-def parse_op_mul():
-    l = yield parse_paren_or_add_or_int()
-    first_rhs = yield parse_op_mul_rhs()
-    rhs_s = yield kleene(parse_op_mul_rhs())
-    rhs_s = [first_rhs] + rhs_s
-
-    e = l
-
-    for (c, r) in rhs_s:
-        e = c(e, r)
-
-    return e
-
-
-@parser_generator
-def parse_op_add():
-    l = yield parse_paren_or_int()
-    first_rhs = yield parse_op_add_rhs()
-    rhs_s = yield kleene(parse_op_add_rhs())
-    rhs_s = [first_rhs] + rhs_s
-
-    e = l
-
-    for (c, r) in rhs_s:
-        e = c(e, r)
-
-    return e
 
 
 @parser_generator
@@ -112,17 +76,13 @@ def parse_paren_or_int():
     return (yield try_parsers(parse_paren(), parse_int()))
 
 
-@parser_generator
-def parse_paren_or_add_or_int():
-    yield consume_whitespace()
-    return (yield try_parsers(parse_op_add(), parse_paren(), parse_int()))
-
-
 @parser_generator
 def parse_expr():
-    yield consume_whitespace()
     return (
-        yield try_parsers(parse_op_mul(), parse_op_add(), parse_paren(), parse_int())
+        yield operator_precedence(
+            parse_paren_or_int(),
+            [(parse_op_add(), 2, "left", Add), (parse_op_mul(), 1, "left", Mul)],
+        )
     )
 
 
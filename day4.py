@@ -1,58 +1,170 @@
+import os
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
 required_tokens = {"byr", "iyr", "eyr", "hgt", "hcl", "ecl", "pid"}
 
-class Passport:
-    def __init__(self, tokens):
-        self.tokens = tokens
+field_bits = {name: 1 << i for i, name in enumerate(["byr", "iyr", "eyr", "hgt", "hcl", "ecl", "pid", "cid"])}
+required_mask = sum(field_bits[name] for name in required_tokens)
+
+token_re = re.compile(r"([^\s:]+):(\S*)")
+year_re = re.compile(r"\d{4}")
+hgt_re = re.compile(r"(\d+)(cm|in)")
+hcl_re = re.compile(r"#[0-9a-f]{6}")
+pid_re = re.compile(r"\d{9}")
+eye_colours = frozenset({"amb", "blu", "brn", "gry", "grn", "hzl", "oth"})
 
-    def valid(self):
-        return not bool(required_tokens - set(self.tokens))
+def year_between(lo, hi):
+    def check(s):
+        return year_re.fullmatch(s) is not None and lo <= int(s) <= hi
+    return check
 
 def parse_hgt(s):
-    if s.endswith("in"):
-        return 59 <= int(s[:-2]) <= 76
-    return 150 <= int(s[:-2]) <= 193
+    m = hgt_re.fullmatch(s)
+    if m is None:
+        return False
+    if m[2] == "in":
+        return 59 <= int(m[1]) <= 76
+    return 150 <= int(m[1]) <= 193
 
 def parse_hcl(s):
-    if not s.startswith("#"):
-        return False
-    return int(s.lstrip("#"), 16)
+    return hcl_re.fullmatch(s) is not None
 
 def parse_ecl(s):
-    return s in {"amb", "blu", "brn", "gry", "grn", "hzl", "oth"}
-
-def parse_token(token, dovalid=False):
-    name, val = token.split(":")
-    if not dovalid:
-        return name
-    try:
-        check = {
-                "byr": lambda x: 1920 <= int(x) <= 2020,
-                "iyr": lambda x: 2010 <= int(x) <= 2020,
-                "eyr": lambda x: 2002 <= int(x) <= 2030,
-                "hgt": parse_hgt,
-                "hcl": parse_hcl,
-                "ecl": parse_ecl,
-                "pid": lambda n: int(n.lstrip("0")) and len(n) == 9,
-                "cid": int,
-                }[name](val)
-        if check is False:
-            return None
-    except:
-        return None
-
-    return name
-
-def parse_passport(lines, dovalid=False):
-    return Passport(list(filter(lambda a: a is not None, (parse_token(t, dovalid) for t in lines.split()))))
-
-def parse_passports(s, dovalid=False):
-    return [parse_passport(p, dovalid) for p in s.split("\n\n")]
+    return s in eye_colours
+
+def parse_pid(s):
+    return pid_re.fullmatch(s) is not None
+
+# built once, and none of these raise on bad input
+field_checks = {
+        "byr": year_between(1920, 2020),
+        "iyr": year_between(2010, 2020),
+        "eyr": year_between(2020, 2030),
+        "hgt": parse_hgt,
+        "hcl": parse_hcl,
+        "ecl": parse_ecl,
+        "pid": parse_pid,
+        "cid": lambda s: True,
+        }
+
+# one pass over a passport's fields, giving bitmasks (see field_bits) of the
+# fields present and the fields that are valid
+def scan_passport(record):
+    present = valid = 0
+    for name, val in token_re.findall(record):
+        bit = field_bits.get(name)
+        if bit is None:
+            continue
+        present |= bit
+        if field_checks[name](val):
+            valid |= bit
+    return present, valid
+
+# yields passport records one at a time from any iterable of lines, such as
+# an open file; blank lines separate records, so only one is held at once
+def read_passports(lines):
+    record = []
+    for line in lines:
+        if line.strip():
+            record.append(line)
+        elif record:
+            yield " ".join(record)
+            record = []
+    if record:
+        yield " ".join(record)
+
+def tally_passports(records):
+    part1 = part2 = 0
+    for record in records:
+        present, valid = scan_passport(record)
+        part1 += present & required_mask == required_mask
+        part2 += valid & required_mask == required_mask
+    return part1, part2
+
+def day4parts(s):
+    return tally_passports(read_passports(s.splitlines()))
+
+def day4file(path):
+    with open(path) as f:
+        return tally_passports(read_passports(f))
+
+# splits a batch file into byte ranges that each start on a passport record,
+# by moving every evenly spaced cut forwards to just after a blank line
+def shard_ranges(path, shards):
+    size = os.path.getsize(path)
+    cuts = [0]
+    with open(path, "rb") as f:
+        for i in range(1, shards):
+            f.seek(max(size * i // shards, cuts[-1]))
+            f.readline()
+            while True:
+                line = f.readline()
+                if not line or not line.strip():
+                    break
+            cuts.append(f.tell())
+    cuts.append(size)
+    return [(start, end) for start, end in zip(cuts, cuts[1:]) if start < end]
+
+def read_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line.decode()
+
+def tally_range(path, start, end):
+    return tally_passports(read_passports(read_range(path, start, end)))
+
+def day4file_parallel(path, workers=None):
+    workers = workers or os.cpu_count()
+    ranges = shard_ranges(path, workers * 4)
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+    part1 = part2 = 0
+    with ProcessPoolExecutor(workers) as pool:
+        for p1, p2 in pool.map(tally_range, [path] * len(ranges), starts, ends):
+            part1 += p1
+            part2 += p2
+    return part1, part2
+
+# passports stored column-wise: one byte per passport of which fields are
+# present, and another of which are valid, so that any set of required fields
+# can be checked across the whole batch without reparsing
+class PassportMasks:
+    def __init__(self):
+        self.present = array("B")
+        self.valid = array("B")
+
+    @classmethod
+    def from_records(cls, records):
+        masks = cls()
+        for record in records:
+            masks.add(record)
+        return masks
+
+    def add(self, record):
+        present, valid = scan_passport(record)
+        self.present.append(present)
+        self.valid.append(valid)
+
+    def count(self, fields=required_tokens, validated=False):
+        mask = sum(field_bits[name] for name in fields)
+        column = np.frombuffer(self.valid if validated else self.present, dtype=np.uint8)
+        return int(np.count_nonzero(column & mask == mask))
 
 def day4part1(s):
-    return sum(p.valid() for p in parse_passports(s))
+    return PassportMasks.from_records(read_passports(s.splitlines())).count()
 
 def day4part2(s):
-    return sum(p.valid() for p in parse_passports(s, True))
+    return PassportMasks.from_records(read_passports(s.splitlines())).count(validated=True)
 
 example = """
 ecl:gry pid:860033327 eyr:2020 hcl:#fffffd
@@ -1143,5 +1255,4 @@ eyr:2028
 """.strip()
 
 print(day4part1(example))
-print(day4part1(ch_input))
-print(day4part2(ch_input))
+print(*day4parts(ch_input), sep="\n")
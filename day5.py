@@ -1,19 +1,79 @@
+import mmap
+import os
+
+import numpy as np
+
+# F/L pick the lower half and B/R the upper, so a pass is just its seat id
+# written in binary
+bsp_digits = str.maketrans("FBLR", "0101")
+
 def parse_bsp(s):
-    (row_l, row_u) = (0, 127)
-    (col_l, col_u) = (0, 7)
+    return int(s.translate(bsp_digits), 2)
+
+# a plane with rows * cols seats (both powers of two) has passes of this
+# many characters: a row half for each row bit, then a column half for each
+# column bit
+def pass_width(rows=128, cols=8):
+    return (rows - 1).bit_length() + (cols - 1).bit_length()
+
+# decodes an (n, width) uint8 array of pass characters into n seat ids
+def decode_seat_chars(chars):
+    upper = (chars == ord("B")) | (chars == ord("R"))
+    return upper @ (1 << np.arange(chars.shape[1] - 1, -1, -1))
+
+# passes are fixed-width records of width characters and a newline (which the
+# last may lack), so a buffer of them can be viewed as an (n, width) array of
+# pass characters in place
+def buffer_seat_ids(buf, width=10):
+    data = np.frombuffer(buf, dtype=np.uint8)
+    n = (len(data) + 1) // (width + 1)
+    if len(data) not in (n * (width + 1), n * (width + 1) - 1) or not (data[width::width + 1] == ord("\n")).all():
+        # the traceback keeps this frame alive, and a view left in it would
+        # stop the caller's mmap from closing
+        del data
+        raise ValueError(f"boarding passes must be {width} characters per line")
+    chars = np.lib.stride_tricks.as_strided(data, shape=(n, width), strides=(width + 1, 1), writeable=False)
+    return decode_seat_chars(chars)
+
+def file_seat_ids(path, width=10):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.int64)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return buffer_seat_ids(mm, width)
+
+# yields seat ids a batch at a time from a binary file or stream, so a feed of
+# passes never needs to be held in full. reads from pipes and sockets can come
+# back short, so a pass split between reads is carried over to the next one
+def read_seat_ids(f, width=10, batch=1 << 16):
+    record = width + 1
+    carry = b""
+    while True:
+        block = f.read(record * batch)
+        if not block:
+            break
+        if carry:
+            block = carry + block
+        whole = len(block) - len(block) % record
+        carry = block[whole:]
+        if whole:
+            yield buffer_seat_ids(memoryview(block)[:whole], width)
+    # the last pass may lack its newline
+    if carry:
+        yield buffer_seat_ids(carry, width)
+
+# one flag per seat of the plane, set for each seat id in any of the batches
+def seat_map(id_batches, rows=128, cols=8):
+    occupied = np.zeros(rows * cols, dtype=bool)
+    for ids in id_batches:
+        occupied[ids] = True
+    return occupied
 
+# every empty seat whose neighbours on both sides are taken
+def free_seats(occupied):
+    return np.flatnonzero(~occupied[1:-1] & occupied[:-2] & occupied[2:]) + 1
 
-    for c in s:
-        print((row_l, row_u))
-        if c == "F":
-            row_u = (row_l + row_u) // 2
-        elif c == "B":
-            row_l = (row_l + row_u) // 2 + 1
-        elif c == "L":
-            col_u = (col_l + col_u) // 2
-        else:
-            col_l = (col_l + col_u) // 2 + 1
-    return row_l * 8 + col_l
+def seat_ids(inp: str):
+    return buffer_seat_ids(inp.encode("ascii"))
 
 my_inp = """FFFBFBFLRR
 FFBBFFFRLL
@@ -791,10 +851,7 @@ BFFFBBBLLL
 FFBBBFBRLL"""
 
 def day5part1(inp: str):
-    return max(parse_bsp(i) for i in inp.splitlines())
+    return int(seat_ids(inp).max())
 
 def day5part2(inp: str):
-    ids = [parse_bsp(i) for i in inp.splitlines()]
-    for x, y in zip(ids, ids[1:]):
-        if x + 1 != y:
-            return x + 1
+    return int(free_seats(seat_map([seat_ids(inp)]))[0])
@@ -1,8 +1,110 @@
+import io
+import string
+
+import numpy as np
+
+# each person's answers as a 26-bit mask, bit i set for the i-th letter
+letter_bits = {c: 1 << i for i, c in enumerate(string.ascii_lowercase)}
+all_answers = (1 << 26) - 1
+
+def answer_mask(person):
+    mask = 0
+    for c in person:
+        mask |= letter_bits[c]
+    return mask
+
+# (questions anyone in the group answered, questions everyone answered)
+def group_masks(group):
+    anyone, everyone = 0, all_answers
+    for person in group.split():
+        mask = answer_mask(person)
+        anyone |= mask
+        everyone &= mask
+    return anyone, everyone & anyone
+
 def part1(group):
-    return len(set(c for c in group if c.strip()))
+    return group_masks(group)[0].bit_count()
 
 def part2(group):
-    return set.intersection(*(set(a) for a in group.split()))
+    return group_masks(group)[1].bit_count()
+
+def both_parts(groups):
+    total1 = total2 = 0
+    for group in groups:
+        anyone, everyone = group_masks(group)
+        total1 += anyone.bit_count()
+        total2 += everyone.bit_count()
+    return total1, total2
+
+# bits set in each byte value, for popcounts over whole arrays
+byte_popcounts = np.array([bin(b).count("1") for b in range(256)], dtype=np.uint8)
+
+def popcounts(masks):
+    return byte_popcounts[masks.view(np.uint8)].reshape(len(masks), -1).sum(axis=1)
+
+# turns a whole survey dump (groups separated by blank lines) into one uint32
+# answer mask per person, plus the offset in that array of each group's first
+# person, without looping in python
+def survey_masks(text):
+    data = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    letters = (data >= ord("a")) & (data <= ord("z"))
+    bits = np.where(letters, np.left_shift(np.uint32(1), (data - ord("a")) & 31, dtype=np.uint32), np.uint32(0))
+
+    line_starts = np.concatenate(([0], np.flatnonzero(data == ord("\n")) + 1))
+    line_starts = line_starts[line_starts < len(data)]
+    if not len(line_starts):
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.intp)
+    line_masks = np.bitwise_or.reduceat(bits, line_starts)
+    # a line with no answers (empty, or just \r or spaces) separates groups
+    blank = line_masks == 0
+
+    people = line_masks[~blank]
+    group_of_person = np.cumsum(blank)[~blank]
+    offsets = np.flatnonzero(np.diff(group_of_person, prepend=-1))
+    return people, offsets
+
+# (questions anyone answered, questions everyone answered) for every group
+def segmented_counts(people, offsets):
+    if not len(offsets):
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    anyone = np.bitwise_or.reduceat(people, offsets)
+    everyone = np.bitwise_and.reduceat(people, offsets)
+    return popcounts(anyone), popcounts(everyone)
+
+def bulk_both_parts(text):
+    anyone, everyone = segmented_counts(*survey_masks(text))
+    return int(anyone.sum()), int(everyone.sum())
+
+# yields each group's (anyone, everyone) masks as soon as the group ends, from
+# any iterable of str or bytes lines such as an open file, so only the group
+# being read is held
+def read_groups(lines):
+    anyone, everyone, seen = 0, all_answers, False
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("ascii")
+        line = line.strip()
+        if line:
+            mask = answer_mask(line)
+            anyone |= mask
+            everyone &= mask
+            seen = True
+        elif seen:
+            yield anyone, everyone
+            anyone, everyone, seen = 0, all_answers, False
+    if seen:
+        yield anyone, everyone
+
+# yields the (part1, part2) totals so far after every group
+def running_totals(groups):
+    total1 = total2 = 0
+    for anyone, everyone in groups:
+        total1 += anyone.bit_count()
+        total2 += everyone.bit_count()
+        yield total1, total2
+
+def today_groups():
+    return read_groups(io.StringIO(today_input))
 
 today_input = """
 x
@@ -2084,4 +2186,4 @@ ktei
 
 yvfta
 atypkqfv
-""".strip().split("\n\n")
+""".strip()
@@ -1,3 +1,5 @@
+from array import array
+
 import comb
 from comb import any_char, consume_any_string, consume_string, consume_whitespace, is_whitespace, kleene, optional, parser_generator, read_integer, run_parser, take_until
 
@@ -5,10 +7,6 @@ class Rule:
     def __init__(self, colour, contains):
         self.colour = colour
         self.contains = contains
-        self.parents = set()
-
-    def learn_about_parent(self, parent_colour):
-        self.parents.add(parent_colour)
 
     def __repr__(self) -> str:
         return f"<rule {self.colour} -> {self.contains}>"
@@ -46,36 +44,107 @@ def p_rule(rule):
         return None
     return r
 
+def csr(n, srcs, dsts, counts=None):
+    # packs the edges srcs[k] -> dsts[k] so the edges out of node i live at
+    # targets[offsets[i]:offsets[i + 1]], with their counts (if any) alongside
+    offsets = array("i", bytes(4 * (n + 1)))
+    for src in srcs:
+        offsets[src + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+    targets = array("i", bytes(4 * len(dsts)))
+    packed = None if counts is None else array("i", bytes(4 * len(counts)))
+    fill = offsets[:-1]
+    for k, src in enumerate(srcs):
+        pos = fill[src]
+        targets[pos] = dsts[k]
+        if packed is not None:
+            packed[pos] = counts[k]
+        fill[src] = pos + 1
+    if packed is None:
+        return offsets, targets
+    return offsets, targets, packed
+
+class BagGraph:
+    # colours interned to dense ids, with the "contains" edges and their
+    # reverse held as CSR arrays rather than a dict of Rule objects
+    def __init__(self, rules):
+        self.colours = []
+        self.ids = {}
+        srcs, dsts, counts = array("i"), array("i"), array("i")
+        for rule in rules:
+            node = self.intern(rule.colour)
+            for n, col in rule.contains:
+                srcs.append(node)
+                dsts.append(self.intern(col))
+                counts.append(n)
+        n = len(self.colours)
+        self.child_offsets, self.children, self.child_counts = csr(n, srcs, dsts, counts)
+        self.parent_offsets, self.parents = csr(n, dsts, srcs)
+        # bags each colour holds, counting itself; filled in by compute_totals
+        self.totals = None
+
+    def intern(self, colour):
+        node = self.ids.get(colour)
+        if node is None:
+            node = self.ids[colour] = len(self.colours)
+            self.colours.append(colour)
+        return node
+
 def find_all_parents(g, start):
-    s = set()
-    t_c = [start]
+    start_id = g.ids[start]
+    offsets, parents = g.parent_offsets, g.parents
+    seen = bytearray(len(g.colours))
+    seen[start_id] = 1
+    t_c = [start_id]
     while t_c:
         n = t_c.pop()
-        s.add(n)
-        t_c.extend(g[n].parents - s)
-    s.remove(start)
-    return s
+        for p in parents[offsets[n]:offsets[n + 1]]:
+            if not seen[p]:
+                seen[p] = 1
+                t_c.append(p)
+    seen[start_id] = 0
+    return {g.colours[i] for i, s in enumerate(seen) if s}
+
+def compute_totals(g):
+    # works out every colour's total children leaves first: a colour is
+    # ready once all of its children are, so each is evaluated once and
+    # deep graphs don't recurse
+    offsets, children, counts = g.child_offsets, g.children, g.child_counts
+    parent_offsets, parents = g.parent_offsets, g.parents
+    n = len(g.colours)
+    pending = array("i", (offsets[i + 1] - offsets[i] for i in range(n)))
+    totals = [0] * n
+    ready = [i for i in range(n) if not pending[i]]
+    while ready:
+        node = ready.pop()
+        total = 1
+        for e in range(offsets[node], offsets[node + 1]):
+            total += counts[e] * totals[children[e]]
+        totals[node] = total
+        for p in parents[parent_offsets[node]:parent_offsets[node + 1]]:
+            pending[p] -= 1
+            if not pending[p]:
+                ready.append(p)
+    # colours on or above a cycle never have all of their children done
+    stuck = [g.colours[i] for i in range(n) if pending[i]]
+    if stuck:
+        raise ValueError(f"bags contain themselves, so {stuck[0]} has no total")
+    g.totals = totals
 
 def calc_total_children(g, start):
-    children = sum(n * calc_total_children(g, c) for n, c in  g[start].contains)
-    return 1 + children
+    if g.totals is None:
+        compute_totals(g)
+    return g.totals[g.ids[start]]
 
 def part1(inp):
-    rules = [p_rule(r) for r in inp]
-    graph = {r.colour: r for r in rules}
-    for rule in rules:
-        for _, col in rule.contains:
-            graph[col].learn_about_parent(rule.colour)
+    graph = BagGraph(p_rule(r) for r in inp)
     can_get_to_shiny_gold = find_all_parents(graph, ("shiny", "gold"))
     print(can_get_to_shiny_gold)
     return len(can_get_to_shiny_gold)
 
 def part2(inp):
-    rules = [p_rule(r) for r in inp]
-    graph = {r.colour: r for r in rules}
-    for rule in rules:
-        for _, col in rule.contains:
-            graph[col].learn_about_parent(rule.colour)
+    graph = BagGraph(p_rule(r) for r in inp)
     inside_shiny_gold = calc_total_children(graph, ("shiny", "gold"))
     return inside_shiny_gold - 1
 